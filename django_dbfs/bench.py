@@ -0,0 +1,236 @@
+from __future__ import division, unicode_literals
+
+import os
+import random
+import stat
+from contextlib import contextmanager
+from time import time
+
+from django.db import connection
+
+from . import fs
+from .fs import DbFs
+from .metrics import count_queries
+
+
+@contextmanager
+def fuse_context(uid, gid, pid):
+    ''' replace fuse_get_context, which only works within a request from the kernel '''
+    fuse_get_context = fs.fuse_get_context
+    fs.fuse_get_context = lambda: (uid, gid, pid)
+    try:
+        yield
+    finally:
+        fs.fuse_get_context = fuse_get_context
+
+
+@contextmanager
+def test_database():
+    ''' run in a throwaway database (in memory for sqlite) '''
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+class Result(object):
+
+    def __init__(self):
+        self.latencies = []
+        self.queries = 0
+        self.bytes = 0
+
+    def as_dict(self):
+        ops = len(self.latencies)
+        latencies = sorted(self.latencies)
+        seconds = sum(latencies)
+        return {
+            'ops': ops,
+            'seconds': seconds,
+            'ops_per_second': ops / seconds if seconds else 0,
+            'queries_per_op': self.queries / ops if ops else 0,
+            'bytes_per_op': self.bytes / ops if ops else 0,
+            'latency_mean_us': 1e6 * seconds / ops if ops else 0,
+            'latency_p50_us': 1e6 * latencies[ops // 2] if ops else 0,
+            'latency_p95_us': 1e6 * latencies[ops * 95 // 100] if ops else 0,
+        }
+
+
+class Benchmark(object):
+    ''' drives DbFs methods directly (without kernel mount) and measures each operation
+
+        Every scenario uses its own volume, so that they do not affect each other.
+    '''
+
+    scenarios = (
+        'sequential_write',
+        'sequential_read',
+        'random_write',
+        'random_read',
+        'small_files',
+        'deep_stat',
+        'large_readdir',
+        'rename',
+    )
+
+    def __init__(self, file_size=8 << 20, chunk_size=64 << 10, files=1000, depth=20, seed=0):
+        self.file_size = file_size
+        self.chunk_size = chunk_size
+        self.files = files
+        self.depth = depth
+        self.random = random.Random(seed)
+        self._name = None
+        self._results = None
+
+    def run(self, scenarios=None):
+        results = {}
+        try:
+            for name in scenarios or self.scenarios:
+                self._name = name
+                self._results = {name: Result()}
+                getattr(self, name)(DbFs('bench_{}'.format(name)))
+                for result_name, result in self._results.items():
+                    results[result_name] = result.as_dict()
+        finally:
+            self._name = self._results = None
+        return results
+
+    @property
+    def _result(self):
+        return self._results[self._name]
+
+    def _op(self, func, *args):
+        ''' call measured operation '''
+        return self._measure(self._result, func, *args)
+
+    def _flush(self, dbfs, path, fh):
+        ''' measure flush separately, so that it does not distort results of writes '''
+        result = self._results.setdefault(self._name + '_flush', Result())
+        return self._measure(result, dbfs.flush, path, fh)
+
+    def _measure(self, measured, func, *args):
+        # queries are only counted, logging them (with data of written blocks) would distort latencies
+        with count_queries() as counter:
+            start = time()
+            result = func(*args)
+            if hasattr(result, 'next') or hasattr(result, '__next__'):
+                result = list(result)
+            measured.latencies.append(time() - start)
+        measured.queries += counter[0]
+        if isinstance(result, bytes):
+            measured.bytes += len(result)
+        return result
+
+    def _chunk(self):
+        return os.urandom(self.chunk_size)
+
+    def _offsets(self):
+        return range(0, self.file_size, self.chunk_size)
+
+    def _random_offsets(self):
+        offsets = list(self._offsets())
+        self.random.shuffle(offsets)
+        return offsets
+
+    def _write_file(self, dbfs, path):
+        fh = dbfs.create(path, stat.S_IFREG | 0o644)
+        for offset in self._offsets():
+            dbfs.write(path, self._chunk(), offset, fh)
+        dbfs.flush(path, fh)
+        dbfs.release(path, fh)
+
+    # Scenarios
+    # =========
+
+    def sequential_write(self, dbfs):
+        fh = dbfs.create('/file', stat.S_IFREG | 0o644)
+        for offset in self._offsets():
+            chunk = self._chunk()
+            self._op(dbfs.write, '/file', chunk, offset, fh)
+            self._result.bytes += len(chunk)
+        self._flush(dbfs, '/file', fh)
+        dbfs.release('/file', fh)
+
+    def sequential_read(self, dbfs):
+        self._write_file(dbfs, '/file')
+        fh = dbfs.open('/file', os.O_RDONLY)
+        for offset in self._offsets():
+            self._op(dbfs.read, '/file', self.chunk_size, offset, fh)
+        dbfs.release('/file', fh)
+
+    def random_write(self, dbfs):
+        self._write_file(dbfs, '/file')
+        fh = dbfs.open('/file', os.O_WRONLY)
+        for offset in self._random_offsets():
+            chunk = self._chunk()
+            self._op(dbfs.write, '/file', chunk, offset, fh)
+            self._result.bytes += len(chunk)
+        self._flush(dbfs, '/file', fh)
+        dbfs.release('/file', fh)
+
+    def random_read(self, dbfs):
+        self._write_file(dbfs, '/file')
+        fh = dbfs.open('/file', os.O_RDONLY)
+        for offset in self._random_offsets():
+            self._op(dbfs.read, '/file', self.chunk_size, offset, fh)
+        dbfs.release('/file', fh)
+
+    def small_files(self, dbfs):
+        data = os.urandom(1024)
+
+        def create(path):
+            fh = dbfs.create(path, stat.S_IFREG | 0o644)
+            dbfs.write(path, data, 0, fh)
+            dbfs.flush(path, fh)
+            dbfs.release(path, fh)
+
+        for i in range(self.files):
+            self._op(create, '/file{}'.format(i))
+            self._result.bytes += len(data)
+
+    def deep_stat(self, dbfs):
+        path = ''
+        for i in range(self.depth):
+            path += '/dir{}'.format(i)
+            dbfs.mkdir(path, 0o755)
+        for i in range(self.files):
+            self._op(dbfs.getattr, path)
+
+    def large_readdir(self, dbfs):
+        for i in range(self.files):
+            dbfs.mknod('/file{}'.format(i), stat.S_IFREG | 0o644, 0)
+        for i in range(10):
+            self._op(dbfs.readdir, '/', None)
+
+    def rename(self, dbfs):
+        dbfs.mkdir('/a', 0o755)
+        dbfs.mkdir('/b', 0o755)
+        for i in range(self.files):
+            dbfs.mknod('/a/file{}'.format(i), stat.S_IFREG | 0o644, 0)
+        for i in range(self.files):
+            # alternately rename within the same directory and move to another one
+            new = '/{}/renamed{}'.format('ab'[i % 2], i)
+            self._op(dbfs.rename, '/a/file{}'.format(i), new)
+
+
+def compare(results, baseline, tolerance):
+    ''' return list of regressions against baseline results
+
+        Latency may grow by tolerance (fraction), number of queries per operation may not grow at all.
+    '''
+    regressions = []
+    for name, result in sorted(results.items()):
+        if name not in baseline:
+            continue
+        base = baseline[name]
+        if result['queries_per_op'] > base['queries_per_op'] + 1e-9:
+            regressions.append('{}: queries per op {:.2f} -> {:.2f}'.format(
+                name, base['queries_per_op'], result['queries_per_op'],
+            ))
+        if result['latency_mean_us'] > base['latency_mean_us'] * (1 + tolerance):
+            regressions.append('{}: mean latency {:.0f}us -> {:.0f}us'.format(
+                name, base['latency_mean_us'], result['latency_mean_us'],
+            ))
+    return regressions
@@ -2,58 +2,144 @@ from __future__ import unicode_literals
 
 import errno
 import os
+from bisect import bisect_right, insort
 
 from django.conf import settings
+from django.db.models import F
 from fuse import FuseOSError
 
-from .models import Block
+from .models import Block, Inode
 
-# 19 bits is 512kB
-BLOCK_BITS = int(getattr(settings, 'DBFS_BLOCK_BITS', 19))
-BLOCK_SIZE = 1 << BLOCK_BITS
-BLOCK_MASK = BLOCK_SIZE - 1
+# maximum size of an extent, 20 bits is 1MB (whole extent is sent in one query, mind max_allowed_packet of MySQL)
+EXTENT_BITS = int(getattr(settings, 'DBFS_EXTENT_BITS', 20))
+EXTENT_SIZE = 1 << EXTENT_BITS
 
-BLOCKS_READ_AHEAD = int(getattr(settings, 'DBFS_BLOCKS_READ_AHEAD=', 10))
+# number of bytes loaded beyond requested range
+READ_AHEAD = int(getattr(settings, 'DBFS_READ_AHEAD', EXTENT_SIZE))
 
-
-def block_offset(offset):
-    return offset & BLOCK_MASK
+# files up to this size are stored within the inode, 0 disables inlining
+INLINE_SIZE = min(int(getattr(settings, 'DBFS_INLINE_SIZE', 4096)), EXTENT_SIZE)
 
 
 class OpenFile(object):
+    ''' open file stored in extents (blocks of variable size)
+
+        Extents never overlap. Writes at the end of an extent make it grow, until it reaches EXTENT_SIZE.
+        Extents stored with larger EXTENT_SIZE (or DBFS_BLOCK_BITS before) are only overwritten.
+        New or grown extents overlapping extents saved by other handles meanwhile are merged with them on flush.
+    '''
 
-    def __init__(self, inode, flags):
+    def __init__(self, inode, flags, metrics=None):
         self.inode = inode
         self.flags = flags
+        self.metrics = metrics
 
         if self.flags & os.O_APPEND:
             self.offset = self.inode.size
         else:
             self.offset = 0
 
-        self._blocks = {}
+        self._extents = {}
+        self._offsets = []
+        # sorted disjoint ranges, for which all overlapping extents have been loaded
+        self._loaded = []
         self._dirty_blocks = set()
+        self._dirty_inline = False
+        # range of inline data written by this handle since the last flush
+        self._inline_changes = None
 
         self.inode.inuse_increment()
 
-    def _block(self):
-        sequence = self.offset >> BLOCK_BITS
-        if sequence not in self._blocks:
-            self._load_blocks(sequence)
-        if sequence not in self._blocks:
-            block = Block()
-            block.inode = self.inode
-            block.sequence = sequence
-            self._blocks[sequence] = block
-        return self._blocks[sequence]
-
-    def _load_blocks(self, sequence):
-        for block in self.inode.blocks.filter(
-            sequence__gte=sequence,
-            sequence__lt=sequence + BLOCKS_READ_AHEAD,
-        ):
-            if block.sequence not in self._blocks:
-                self._blocks[block.sequence] = block
+    @property
+    def dirty(self):
+        return bool(self._dirty_blocks) or self._dirty_inline
+
+    @property
+    def inline(self):
+        return self.inode.inline_data is not None
+
+    def _promote(self, start=0, end=None):
+        ''' move inline data (or given range of them) to extents '''
+        data = self.inode.inline_data[start:end]
+        self.inode.inline_data = None
+        self._dirty_inline = True
+        self._inline_changes = None
+        if data:
+            offset = self.offset
+            self.seek(start)
+            self.write(bytes(data))
+            self.seek(offset)
+
+    def _save_inline(self):
+        ''' save inline data, return False if another handle has moved the data to blocks meanwhile,
+            in which case the data are moved to extents of this handle too
+        '''
+        if self.inode.save_size(inline=True):
+            return True
+        size = self.inode.size
+        self.inode.refresh_from_db(fields=['size'])
+        self.inode.size = max(self.inode.size, size)
+        # write only the changes of this handle over the data moved by the other one
+        self._promote(*self._inline_changes or (0, 0))
+        return False
+
+    def _add_extent(self, offset, data):
+        block = Block()
+        block.inode = self.inode
+        block.offset = offset
+        block.data = data
+        self._extents[offset] = block
+        insort(self._offsets, offset)
+        return block
+
+    def _load(self, start, end):
+        ''' make sure, that all extents overlapping given range are loaded '''
+        # the last loaded range starting at or before start
+        i = bisect_right(self._loaded, (start, float('inf'))) - 1
+        if i >= 0 and end <= self._loaded[i][1]:
+            if self.metrics:
+                self.metrics.hit('blocks')
+            return
+        if self.metrics:
+            self.metrics.miss('blocks')
+        end += READ_AHEAD
+        blocks = self._stored(start, end)
+        for block in blocks:
+            if block.offset not in self._extents:
+                self._extents[block.offset] = block
+                insort(self._offsets, block.offset)
+        # merge with overlapping or adjacent loaded ranges
+        if i < 0 or self._loaded[i][1] < start:
+            i += 1
+        j = i
+        while j < len(self._loaded) and self._loaded[j][0] <= end:
+            j += 1
+        if j > i:
+            start = min(start, self._loaded[i][0])
+            end = max(end, self._loaded[j - 1][1])
+        self._loaded[i:j] = [(start, end)]
+
+    def _stored(self, start, end):
+        ''' return stored extents overlapping given range (or ending at its start) '''
+        # extents never overlap, so only the last one starting at or before start may reach it,
+        # its offset bounds the scan of the (inode, offset) index
+        first = list(self.inode.blocks.filter(offset__lte=start).order_by('-offset').values_list('offset', flat=True)[:1])
+        return self.inode.blocks.filter(
+            offset__gte=first[0] if first else start,
+            offset__lt=end,
+            # extent ending at start is loaded too, so that appends make it grow
+            length__gte=start - F('offset'),
+        )
+
+    def _find(self, offset):
+        ''' return the last extent starting at or before offset (or None)
+            and the offset of the next extent (or None)
+        '''
+        i = bisect_right(self._offsets, offset)
+        return (
+            self._extents[self._offsets[i - 1]] if i else None,
+            self._offsets[i] if i < len(self._offsets) else None,
+        )
 
     def seek(self, offset):
         self.offset = offset
@@ -61,43 +147,165 @@ class OpenFile(object):
     def read(self, length):
         if self.flags & os.O_WRONLY:
             raise FuseOSError(errno.EACCES)
-        data = b''
-        length = min(self.inode.size - self.offset, length)
-        while length:
-            block_offset = self.offset & BLOCK_MASK
-            size = min(length, BLOCK_SIZE - block_offset)
-            block = self._block()
-            data += block.data[block_offset:block_offset + size].ljust(size, b'\x00')
-            length -= size
-            self.offset += size
-        return data
+        length = max(min(self.inode.size - self.offset, length), 0)
+        if self.inline:
+            data = self.inode.inline_data[self.offset:self.offset + length].ljust(length, b'\x00')
+            self.offset += length
+            return data
+        end = self.offset + length
+        self._load(self.offset, end)
+        chunks = []
+        while self.offset < end:
+            extent, next_offset = self._find(self.offset)
+            if extent is not None and self.offset < extent.offset + len(extent.data):
+                start = self.offset - extent.offset
+                chunk = bytes(extent.data[start:start + end - self.offset])
+            else:
+                # hole
+                chunk = b'\x00' * (min(end, next_offset or end) - self.offset)
+            chunks.append(chunk)
+            self.offset += len(chunk)
+        return b''.join(chunks)
 
     def write(self, buf):
         if self.flags == os.O_RDONLY:
             raise FuseOSError(errno.EACCES)
         length = len(buf)
+        if self.inline:
+            if self.offset + length <= INLINE_SIZE:
+                data = self.inode.inline_data
+                self.inode.inline_data = (
+                    data[:self.offset].ljust(self.offset, b'\x00') + buf + data[self.offset + length:]
+                )
+                start, end = self._inline_changes or (len(data), 0)
+                self._inline_changes = (min(start, self.offset, len(data)), max(end, self.offset + length))
+                self.offset += length
+                self.inode.size = max(self.inode.size, self.offset)
+                self._dirty_inline = True
+                return length
+            self._promote()
+        self._load(self.offset, self.offset + length)
         while buf:
-            block_offset = self.offset & BLOCK_MASK
-            size = min(len(buf), BLOCK_SIZE - block_offset)
-            block = self._block()
-            block.data = block.data[:block_offset].ljust(block_offset, b'\x00') + buf[:size]
+            extent, next_offset = self._find(self.offset)
+            size = len(buf) if next_offset is None else min(len(buf), next_offset - self.offset)
+            start = None if extent is None else self.offset - extent.offset
+            limit = None if extent is None else max(len(extent.data), EXTENT_SIZE)
+            if start is not None and start <= len(extent.data) and start < limit:
+                # overwrite or append to the extent
+                size = min(size, limit - start)
+                if not isinstance(extent.data, bytearray):
+                    extent.data = bytearray(extent.data)
+                extent.data[start:start + size] = buf[:size]
+            else:
+                size = min(size, EXTENT_SIZE)
+                extent = self._add_extent(self.offset, bytearray(buf[:size]))
             buf = buf[size:]
             self.offset += size
             self.inode.size = max(self.inode.size, self.offset)
-            self._dirty_blocks.add(block)
+            self._dirty_blocks.add(extent)
         return length
 
-    def flush(self, *args):
-        if self._dirty_blocks:
-            for block in self._dirty_blocks:
+    def _save_blocks(self):
+        ''' save dirty extents and return the difference of the number of stored ones '''
+        new_blocks = 0
+        locked = merged = False
+        for block in sorted(self._dirty_blocks, key=lambda block: block.offset):
+            block.data = bytes(block.data)
+            if block.pk is not None and len(block.data) <= block.length:
+                # overwrite within the stored extent, unless another handle has merged it meanwhile
+                if Block.objects.filter(pk=block.pk, offset=block.offset).update(
+                    data=block.data, length=len(block.data),
+                ):
+                    block.length = len(block.data)
+                    continue
+                block.pk = None
+            if not locked:
+                # other handles may create or grow extents of the inode concurrently
+                Inode.objects.select_for_update().filter(pk=self.inode.pk).values_list('pk').get()
+                locked = True
+            end = block.offset + len(block.data)
+            overlapping = [
+                stored for stored in self._stored(block.offset, end)
+                if stored.pk != block.pk and stored.offset + stored.length > block.offset
+            ]
+            if overlapping:
+                new_blocks += self._merge(block, overlapping)
+                merged = True
+            else:
+                new_blocks += block.pk is None
+                block.length = len(block.data)
                 block.save()
-            self.inode.save_size()
+        self._dirty_blocks.clear()
+        if merged:
+            # loaded extents may have been replaced
+            self._extents = {}
+            self._offsets = []
+            self._loaded = []
+        return new_blocks
+
+    def _merge(self, block, overlapping):
+        ''' replace the block and overlapping extents saved by other handles by extents with data of all of them
+            (data of the block win) and return the difference of the number of stored extents
+        '''
+        start = min([block.offset] + [stored.offset for stored in overlapping])
+        end = max([block.offset + len(block.data)] + [stored.offset + stored.length for stored in overlapping])
+        data = bytearray(end - start)
+        for stored in overlapping + [block]:
+            data[stored.offset - start:stored.offset - start + len(stored.data)] = bytes(stored.data)
+        deleted = Block.objects.filter(pk__in=[stored.pk for stored in overlapping + [block] if stored.pk]).delete()[0]
+        Block.objects.bulk_create([
+            Block(inode=self.inode, offset=offset, length=min(EXTENT_SIZE, end - offset),
+                  data=bytes(data[offset - start:offset - start + EXTENT_SIZE]))
+            for offset in range(start, end, EXTENT_SIZE)
+        ])
+        return (end - start + EXTENT_SIZE - 1) // EXTENT_SIZE - deleted
+
+    def flush(self, *args):
+        if self.dirty:
+            if not (self.inline and self._save_inline()):
+                self.inode.save_size(blocks=self._save_blocks(), inline=self._dirty_inline)
+            self._dirty_inline = False
+            self._inline_changes = None
 
     def truncate(self, length):
         if self.flags == os.O_RDONLY:
             raise FuseOSError(errno.EACCES)
+        if self.inline:
+            if length <= INLINE_SIZE:
+                self.inode.inline_data = self.inode.inline_data[:length]
+                self.inode.size = length
+                if self._save_inline():
+                    self._dirty_inline = False
+                    self._inline_changes = None
+                    return
+            else:
+                self._promote()
+        # delete extents beyond the end
+        deleted = self.inode.blocks.filter(offset__gte=length).delete()[0]
+        i = bisect_right(self._offsets, length - 1)
+        for offset in self._offsets[i:]:
+            self._dirty_blocks.discard(self._extents.pop(offset))
+        del self._offsets[i:]
+        # cut the last extent
+        self._load(length, length)
+        extent = self._find(length)[0]
+        if extent is not None and extent.offset + len(extent.data) > length:
+            extent.data = extent.data[:length - extent.offset]
+            self._dirty_blocks.add(extent)
+        new_blocks = self._save_blocks()
         self.inode.size = length
-        self.inode.save_size()
+        self.inode.save_size(blocks=new_blocks - deleted, inline=self._dirty_inline)
+        self._dirty_inline = False
+
+    def dirty_bytes(self):
+        inline = len(self.inode.inline_data or b'') if self._dirty_inline else 0
+        return inline + sum(len(block.data) for block in list(self._dirty_blocks))
+
+    def invalidate(self):
+        ''' forget extents loaded from database, the inode has been changed by another mount '''
+        self._extents = {block.offset: block for block in self._dirty_blocks}
+        self._offsets = sorted(self._extents)
+        self._loaded = []
 
     def close(self, *args):
         self.inode.inuse_decrement()
@@ -3,15 +3,42 @@ from __future__ import unicode_literals
 import errno
 import os
 import stat
+from collections import defaultdict
+from threading import Lock
 from time import time
 
+from django.conf import settings
 from django.db import transaction
 from fuse import FuseOSError, Operations, fuse_get_context
 
-from .file import BLOCK_SIZE, OpenFile
-from .models import Inode, TreeNode
+from .file import EXTENT_SIZE, INLINE_SIZE, OpenFile
+from .metrics import Metrics, MetricsServer
+from .models import Inode, TreeNode, Volume
+from .reaper import REAPER_INTERVAL, Reaper
 from .utils import ThreadSafeCounter, get_groups
 
+# how often (in seconds) to check, whether the volume has been changed by another mount
+COHERENCE_INTERVAL = float(getattr(settings, 'DBFS_COHERENCE_INTERVAL', 1))
+
+# maximum number of cached tree nodes
+NODES_CACHE_SIZE = int(getattr(settings, 'DBFS_NODES_CACHE_SIZE', 10000))
+
+# number of inodes checked for changes by one query
+GENERATION_CHECK_CHUNK = 500
+
+# attributes reloaded when the inode has been changed by another mount
+INODE_FIELDS = ('mode', 'uid', 'gid', 'atime', 'mtime', 'ctime', 'generation')
+
+# maximum size of files in the volume (in bytes) by volume name
+QUOTAS = getattr(settings, 'DBFS_QUOTAS', {})
+
+# unit of space reported by statfs
+FRAGMENT_SIZE = 4096
+
+# free space and free inodes reported by statfs for volumes without quota
+UNLIMITED_SIZE = 1 << 50
+UNLIMITED_INODES = 1 << 32
+
 # for some reason you can't get umask without changing it
 UMASK = os.umask(0)
 os.umask(UMASK)
@@ -19,30 +46,134 @@ os.umask(UMASK)
 
 class DbFs(Operations):
 
-    def __init__(self, volume):
+    def __init__(self, volume, stats_socket=None, nothreads=False):
         self.volume = volume
+        # fuse runs in single thread, so the database is probably not ready for concurrent access
+        self.nothreads = nothreads
+        self._volume = Volume.objects.get_or_create(name=volume)[0]
+        self.quota = QUOTAS.get(volume)
 
         self._nodes = {}
+        # keys of cached nodes by pk of the parent's inode
+        self._children = defaultdict(set)
+        # cached inodes by pk, so that all nodes and open files of one inode share the same object
+        self._inodes = {}
+        self._generation_checked = time()
+        self._generation_lock = Lock()
+        # incremented whenever cached nodes are dropped, so that nodes looked up meanwhile are not cached
+        self._invalidations = 0
         self._fh_counter = ThreadSafeCounter()
         self._files = {}
 
+        # metrics are only collected, if there is a way to read them
+        self.stats_socket = stats_socket
+        self.metrics = None
+        self._metrics_server = None
+        self._reaper = Reaper(self._volume)
+        if stats_socket:
+            self.metrics = Metrics(volume)
+            self.metrics.gauge('open_files', 'Number of open files.', lambda: len(self._files))
+            self.metrics.gauge('dirty_bytes', 'Number of bytes written, but not flushed yet.', lambda: sum(
+                f.dirty_bytes() for f in list(self._files.values())
+            ))
+            self.metrics.gauge('cached_nodes', 'Number of cached tree nodes.', lambda: len(self._nodes))
+
         # create root node while in single thread
         self._root_node()
 
+    def __call__(self, op, *args):
+        if self.metrics is None:
+            return super(DbFs, self).__call__(op, *args)
+        return self.metrics.measure(op, super(DbFs, self).__call__, op, *args)
+
     # Helpers
     # =======
 
     def _root_node(self):
+        key = (None, self.volume)
+        try:
+            return self._nodes[key]
+        except KeyError:
+            pass
         try:
-            root_node = TreeNode.objects.get(parent=None, name=self.volume)
+            root_node = TreeNode.objects.select_related('inode').get(parent=None, name=self.volume)
         except TreeNode.DoesNotExist:
             root_node = self._mknod(None, self.volume, stat.S_IFDIR | (0777 & ~UMASK))
             self._link(root_node, '.', root_node.inode)
             self._link(root_node, '..', root_node.inode)
+        root_node.inode = self._cache_inode(root_node.inode)
+        self._nodes[key] = root_node
         return root_node
 
+    def _cache_inode(self, inode):
+        return self._inodes.setdefault(inode.pk, inode)
+
+    def _clear_cache(self):
+        self._invalidations += 1
+        self._nodes.clear()
+        self._children.clear()
+        self._inodes = {f.inode.pk: f.inode for f in list(self._files.values())}
+
+    def _forget_children(self, pks):
+        ''' drop cached nodes within directories with given inodes '''
+        self._invalidations += 1
+        for pk in pks:
+            for key in self._children.pop(pk, ()):
+                self._nodes.pop(key, None)
+
+    def _check_generation(self):
+        ''' reload cached inodes, which have been changed by another mount,
+            and drop cached nodes within changed directories
+        '''
+        now = time()
+        if now - self._generation_checked < COHERENCE_INTERVAL:
+            return
+        inodes = list(self._inodes.values())
+        pks = [inode.pk for inode in inodes]
+        generations = {}
+        for i in range(0, len(pks), GENERATION_CHECK_CHUNK):
+            generations.update(Inode.objects.filter(
+                pk__in=pks[i:i + GENERATION_CHECK_CHUNK],
+            ).values_list('pk', 'generation'))
+        with self._generation_lock:
+            self._generation_checked = now
+            changed = [inode for inode in inodes if generations.get(inode.pk, inode.generation) != inode.generation]
+            for inode in changed:
+                self._reload_inode(inode)
+            if changed:
+                self._forget_children([inode.pk for inode in changed])
+
+    def _reload_inode(self, inode):
+        files = [f for f in list(self._files.values()) if f.inode is inode]
+        fields = INODE_FIELDS
+        # keep size and data, which have not been flushed yet
+        if not any(f.dirty for f in files):
+            fields += ('size', 'inline_data')
+        inode.refresh_from_db(fields=fields)
+        for f in files:
+            f.invalidate()
+
+    def _changed(self, *directories):
+        ''' update times of directories, whose entries have been changed,
+            which increments their generations, so that other mounts notice the change
+        '''
+        now = time()
+        for directory in directories:
+            directory.inode.mtime = directory.inode.ctime = now
+            directory.inode.save_times()
+        pks = [directory.inode.pk for directory in directories]
+        with self._generation_lock:
+            self._forget_children(pks)
+        # other threads may have cached nodes changed by this transaction before it is committed
+        transaction.on_commit(lambda: self._committed(pks))
+
+    def _committed(self, pks):
+        with self._generation_lock:
+            self._forget_children(pks)
+
     def _resolve(self, path, context=None):
         context = context or fuse_get_context()
+        self._check_generation()
         node = self._root_node()
         for part in path[1:].split(os.path.sep):
             if part:
@@ -51,10 +182,32 @@ class DbFs(Operations):
         return node
 
     def _resolve_subnode(self, node, name):
+        key = (node.pk, name)
+        invalidations = self._invalidations
         try:
-            return node.children.get(name=name)
-        except:
+            subnode = self._nodes[key]
+        except KeyError:
+            if self.metrics:
+                self.metrics.miss('nodes')
+        else:
+            if self.metrics:
+                self.metrics.hit('nodes')
+            return subnode
+        try:
+            subnode = node.children.select_related('inode').get(name=name)
+        except TreeNode.DoesNotExist:
             raise FuseOSError(errno.ENOENT)
+        subnode.parent = node
+        with self._generation_lock:
+            # the node may be already stale, if the tree has been changed during the lookup
+            cache = invalidations == self._invalidations
+            if cache and len(self._nodes) >= NODES_CACHE_SIZE:
+                self._clear_cache()
+            subnode.inode = self._cache_inode(subnode.inode)
+            if cache:
+                self._nodes[key] = subnode
+                self._children[node.inode.pk].add(key)
+        return subnode
 
     def _resolve_file(self, fh):
         try:
@@ -62,6 +215,27 @@ class DbFs(Operations):
         except KeyError:
             raise FuseOSError(errno.ENOENT)
 
+    def _check_quota(self, f, size):
+        ''' check, that the file may grow to given size
+
+            Growth of all files open by this mount, which has not been flushed yet, is counted too.
+            Unflushed growth of files open by other mounts is not known, so the quota is not exact.
+        '''
+        if self.quota is not None and size > f.inode.size:
+            if self._volume.get_usage()[0] + self._unflushed_growth(f, size) > self.quota:
+                raise FuseOSError(errno.EDQUOT)
+
+    def _unflushed_growth(self, f, size):
+        ''' return growth of open files (with file f grown to size), which is not counted in volume usage '''
+        # inodes are shared by all handles, their flushed size is accounted by the last flush of any of them
+        inodes = {open_file.inode.pk: open_file.inode for open_file in list(self._files.values())}
+        inodes[f.inode.pk] = f.inode
+        growth = 0
+        for inode in inodes.values():
+            inode_size = max(inode.size, size) if inode is f.inode else inode.size
+            growth += max(inode_size - inode.flushed_size, 0)
+        return growth
+
     # Filesystem methods
     # ==================
 
@@ -105,9 +279,20 @@ class DbFs(Operations):
         inode.save_uid_gid()
         return 0
 
+    def init(self, path):
+        # start threads after fuse daemonized the process
+        if self.stats_socket:
+            self._metrics_server = MetricsServer(self.stats_socket, self.metrics)
+            self._metrics_server.start()
+        if REAPER_INTERVAL and not self.nothreads:
+            self._reaper.start()
+
     def destroy(self, path):
         for f in self._files.values():
             f.close()
+        if self._metrics_server:
+            self._metrics_server.stop()
+        self._reaper.stop()
 
     @transaction.atomic
     def getattr(self, path, fh=None):
@@ -115,48 +300,59 @@ class DbFs(Operations):
         node = self._resolve(path, context)
         if node.parent:
             self._access(node.parent.inode, os.R_OK, context)
-        return self._resolve(path).inode.stat()
+        return node.inode.stat()
 
     def readdir(self, path, fh):
         context = fuse_get_context()
         node = self._resolve(path, context)
         self._access(node.inode, os.R_OK, context)
-        for node in node.children.all():
-            yield node.name
+        return list(node.children.values_list('name', flat=True))
 
     @transaction.atomic
     def readlink(self, path):
+        inode = self._resolve(path).inode
+        if inode.inline_data is not None:
+            return bytes(inode.inline_data)
         fh = self.open(path, os.O_RDONLY)
         try:
-            return self.read(path, BLOCK_SIZE, 0, fh)
+            return self.read(path, inode.size, 0, fh)
         finally:
             self.release(path, fh)
 
     @transaction.atomic
     def mknod(self, path, mode, dev):
         dirname, filename = os.path.split(path)
-        self._mknod(self._resolve(dirname), filename, mode)
+        parent = self._resolve(dirname)
+        self._mknod(parent, filename, mode)
+        self._changed(parent)
 
-    def _mknod(self, parent, filename, mode):
+    def _mknod(self, parent, filename, mode, data=None):
         now = time()
         uid, gid, pid = fuse_get_context()
         if parent is not None:
             self._access(parent.inode, os.X_OK | os.W_OK, (uid, gid, pid))
+        if data is None and INLINE_SIZE and stat.S_ISREG(mode):
+            data = b''
         try:
-            return TreeNode.objects.create(
+            node = TreeNode.objects.create(
                 parent=parent,
                 name=filename,
                 inode=Inode.objects.create(
+                    volume=self._volume,
                     mode=mode,
                     uid=uid,
                     gid=gid,
                     atime=now,
                     mtime=now,
                     ctime=now,
+                    size=len(data or b''),
+                    inline_data=data,
                 ),
             )
         except:
             raise FuseOSError(errno.EEXIST)
+        node.inode.update_volume_usage(size=node.inode.size, inodes=1)
+        return node
 
     @transaction.atomic
     def mkdir(self, path, mode):
@@ -164,6 +360,7 @@ class DbFs(Operations):
         node = self._mknod(self._resolve(dirname), filename, stat.S_IFDIR | mode)
         self._link(node, '.', node.inode)
         self._link(node, '..', node.parent.inode)
+        self._changed(node.parent)
 
     @transaction.atomic
     def rmdir(self, path):
@@ -173,22 +370,44 @@ class DbFs(Operations):
         if node.children.exclude(name__in=('.', '..')).exists():
             raise FuseOSError(errno.ENOTEMPTY)
         node.delete()
+        self._changed(node.parent)
 
     @transaction.atomic
     def unlink(self, path):
         context = fuse_get_context()
         node = self._resolve(path, context)
         self._access(node.parent.inode, os.W_OK, context)
-        self._resolve(path).delete()
+        node.delete()
+        self._changed(node.parent)
+
+    def statfs(self, path):
+        size, blocks, inodes = self._volume.get_usage()
+        used = (size + FRAGMENT_SIZE - 1) // FRAGMENT_SIZE
+        if self.quota is None:
+            free = UNLIMITED_SIZE // FRAGMENT_SIZE
+        else:
+            free = max(self.quota // FRAGMENT_SIZE - used, 0)
+        return {
+            'f_bsize': EXTENT_SIZE,
+            'f_frsize': FRAGMENT_SIZE,
+            'f_blocks': used + free,
+            'f_bfree': free,
+            'f_bavail': free,
+            'f_files': inodes + UNLIMITED_INODES,
+            'f_ffree': UNLIMITED_INODES,
+            'f_favail': UNLIMITED_INODES,
+            'f_namemax': 255,
+        }
 
     @transaction.atomic
     def symlink(self, target, source):
-        fh = self.create(target, stat.S_IFLNK | 0777)
-        try:
-            self.write(target, source, 0, fh)
-            self.flush(target, fh)
-        finally:
-            self.release(target, fh)
+        # symlinks are always stored within the inode
+        dirname, filename = os.path.split(target)
+        if not isinstance(source, bytes):
+            source = source.encode('utf-8')
+        parent = self._resolve(dirname)
+        self._mknod(parent, filename, stat.S_IFLNK | 0777, source)
+        self._changed(parent)
 
     @transaction.atomic
     def rename(self, old, new):
@@ -197,24 +416,21 @@ class DbFs(Operations):
         self._access(node.parent.inode, os.W_OK, context)
         old_dirname, old_name = os.path.split(old)
         new_dirname, new_name = os.path.split(new)
-        now = time()
+        directories = [node.parent]
         if old_dirname != new_dirname:
             new_parent = self._resolve(new_dirname, context)
             self._access(new_parent.inode, os.W_OK, context)
+            directories.append(new_parent)
         node.name = new_name
-        # update parent's mtime
-        node.parent.inode.mtime = now
-        node.parent.inode.save_times()
         if old_dirname != new_dirname:
             # change parent
             node.parent = new_parent
             if stat.S_ISDIR(node.inode.mode):
                 # update .. link to new parent
                 node.children.filter(name='..').update(inode=new_parent.inode)
-            # update new parent's mtime
-            new_parent.inode.mtime = now
-            new_parent.inode.save_times()
+                directories.append(node)
         node.save()
+        self._changed(*directories)
 
     @transaction.atomic
     def link(self, target, source):
@@ -222,7 +438,8 @@ class DbFs(Operations):
         context = fuse_get_context()
         parent = self._resolve(dirname, context)
         self._access(parent.inode, os.W_OK, context)
-        self._link(parent, filename, self._resolve(source, context))
+        self._link(parent, filename, self._resolve(source, context).inode)
+        self._changed(parent)
 
     def _link(self, parent, name, inode):
         try:
@@ -270,16 +487,18 @@ class DbFs(Operations):
 
     def _open(self, inode, flags):
         fh = next(self._fh_counter)
-        self._files[fh] = OpenFile(inode, flags)
+        self._files[fh] = OpenFile(inode, flags, self.metrics)
         return fh
 
     def read(self, path, length, offset, fh):
+        self._check_generation()
         f = self._resolve_file(fh)
         f.seek(offset)
         return f.read(length)
 
     def write(self, path, buf, offset, fh):
         f = self._resolve_file(fh)
+        self._check_quota(f, offset + len(buf))
         f.seek(offset)
         return f.write(buf)
 
@@ -287,12 +506,20 @@ class DbFs(Operations):
     def truncate(self, path, length, fh=None):
         if fh is None:
             fh = self.open(path, os.O_WRONLY)
-        self._resolve_file(fh).truncate(length)
+            try:
+                self.truncate(path, length, fh)
+            finally:
+                self.release(path, fh)
+            return
+        f = self._resolve_file(fh)
+        self._check_quota(f, length)
+        f.truncate(length)
 
     @transaction.atomic
     def flush(self, path, fh):
         self._resolve_file(fh).flush()
 
+    @transaction.atomic
     def release(self, path, fh):
         self._resolve_file(fh).close()
         del self._files[fh]
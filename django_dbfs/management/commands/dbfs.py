@@ -1,3 +1,6 @@
+import os
+import stat
+
 from django.conf import settings
 from django.core.management.base import BaseCommand, CommandError
 from fuse import FUSE
@@ -63,7 +66,8 @@ class Command(BaseCommand):
             default=False,
             help=(
                 'Do not use threads. Use this option if you use sqlite database backend. '
-                'Bud note that you should avoid using sqlite database backend in production.'
+                'Bud note that you should avoid using sqlite database backend in production. '
+                'Orphaned inodes are not deleted in background then, use command dbfs_reap.'
             ),
         )
         parser.add_argument(
@@ -76,6 +80,16 @@ class Command(BaseCommand):
                 'See fuse manual page for further information.'
             ),
         )
+        parser.add_argument(
+            '--stats-socket',
+            action='store',
+            dest='stats_socket',
+            default=None,
+            help=(
+                'Collect per-operation metrics and serve them in Prometheus text format on given unix socket. '
+                'Use command dbfs_stats to read them.'
+            ),
+        )
         parser.add_argument('volume', help='name of the virtual volume')
         parser.add_argument('mountpoint', nargs='?', help='mount point')
 
@@ -102,8 +116,12 @@ class Command(BaseCommand):
                         volume,
                     ))
 
+        stats_socket = options['stats_socket']
+        if stats_socket and os.path.lexists(stats_socket) and not stat.S_ISSOCK(os.lstat(stats_socket).st_mode):
+            raise CommandError('Stats socket {} exists and is not a socket'.format(stats_socket))
+
         FUSE(
-            DbFs(volume),
+            DbFs(volume, stats_socket=stats_socket, nothreads=options['nothreads']),
             mountpoint,
             debug=options['debug'],
             foreground=options['foreground'],
@@ -0,0 +1,104 @@
+import json
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ...bench import Benchmark, compare, fuse_context, test_database
+
+
+class Command(BaseCommand):
+
+    help = (
+        'Run performance benchmark of filesystem operations without mounting it. '
+        'The benchmark runs in a test database, which is created and destroyed automatically '
+        '(sqlite test database is kept in memory). '
+        'Results (latency and number of queries per operation) are printed as JSON. '
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--scenario',
+            action='append',
+            dest='scenarios',
+            choices=Benchmark.scenarios,
+            help='Run only given scenario. May be used repeatedly. By default all scenarios are run.',
+        )
+        parser.add_argument(
+            '--file-size',
+            action='store',
+            dest='file_size',
+            type=int,
+            default=8 << 20,
+            help='Size of file used for read and write scenarios in bytes.',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            action='store',
+            dest='chunk_size',
+            type=int,
+            default=64 << 10,
+            help='Size of a single read or write in bytes.',
+        )
+        parser.add_argument(
+            '--files',
+            action='store',
+            dest='files',
+            type=int,
+            default=1000,
+            help='Number of files (or repetitions) used for metadata scenarios.',
+        )
+        parser.add_argument(
+            '--depth',
+            action='store',
+            dest='depth',
+            type=int,
+            default=20,
+            help='Depth of path used for deep_stat scenario.',
+        )
+        parser.add_argument(
+            '--output',
+            action='store',
+            dest='output',
+            help='Write results to given file instead of standard output.',
+        )
+        parser.add_argument(
+            '--baseline',
+            action='store',
+            dest='baseline',
+            help=(
+                'Compare results with results of previous run stored in given file. '
+                'The command fails, if number of queries per operation grows '
+                'or if mean latency grows more than allowed by --tolerance.'
+            ),
+        )
+        parser.add_argument(
+            '--tolerance',
+            action='store',
+            dest='tolerance',
+            type=float,
+            default=0.2,
+            help='Allowed growth of mean latency compared to baseline (fraction, default 0.2).',
+        )
+
+    def handle(self, **options):
+        benchmark = Benchmark(
+            file_size=options['file_size'],
+            chunk_size=options['chunk_size'],
+            files=options['files'],
+            depth=options['depth'],
+        )
+        with test_database(), fuse_context(os.getuid(), os.getgid(), os.getpid()):
+            results = benchmark.run(options['scenarios'])
+
+        output = json.dumps(results, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output)
+        else:
+            self.stdout.write(output)
+
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                regressions = compare(results, json.load(f), options['tolerance'])
+            if regressions:
+                raise CommandError('Performance regressions:\n' + '\n'.join(regressions))
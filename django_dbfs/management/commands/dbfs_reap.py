@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from ...reaper import Reaper
+from ...utils import get_volumes
+
+
+class Command(BaseCommand):
+
+    help = (
+        'Delete orphaned (unlinked and closed) inodes of specified virtual volumes with their blocks. '
+        'Mounted volumes are reaped in background thread, unless settings.DBFS_REAPER_INTERVAL is 0. '
+        'Use this command (e.g. from cron) if the thread is disabled, e.g. with sqlite database backend. '
+        'All volumes are reaped by default. '
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('volumes', nargs='*', help='names of the virtual volumes')
+
+    def handle(self, volumes, **options):
+        for volume in get_volumes(volumes):
+            self.stdout.write('{}: {} inodes deleted'.format(volume.name, Reaper(volume).reap()))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from ...utils import get_volumes
+
+
+class Command(BaseCommand):
+
+    help = (
+        'Recompute usage counters (size, blocks and inodes) of specified virtual volumes. '
+        'The counters are maintained incrementally, but they may drift, e.g. after a crash. '
+        'Run this command periodically (e.g. from cron) to fix them. All volumes are reconciled by default. '
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('volumes', nargs='*', help='names of the virtual volumes')
+
+    def handle(self, volumes, **options):
+        for volume in get_volumes(volumes):
+            volume.reconcile()
+            self.stdout.write('{}: {} bytes, {} blocks, {} inodes'.format(
+                volume.name, volume.used_size, volume.used_blocks, volume.used_inodes,
+            ))
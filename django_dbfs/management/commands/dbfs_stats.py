@@ -0,0 +1,31 @@
+import socket
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+
+    help = (
+        'Print metrics of mounted volume in Prometheus text format. '
+        'The volume has to be mounted with option --stats-socket. '
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('socket', help='path to the socket given to dbfs --stats-socket')
+
+    def handle(self, **options):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(options['socket'])
+        except socket.error as e:
+            raise CommandError('Unable to connect to {}: {}'.format(options['socket'], e))
+        chunks = []
+        try:
+            while True:
+                chunk = sock.recv(65536)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+        finally:
+            sock.close()
+        self.stdout.write(b''.join(chunks).decode('utf-8'), ending='')
@@ -0,0 +1,199 @@
+from __future__ import unicode_literals
+
+import errno
+import os
+import stat
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import contextmanager
+from threading import Lock, Thread
+from time import time
+
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.backends.utils import CursorWrapper
+
+try:
+    from socketserver import StreamRequestHandler, ThreadingUnixStreamServer
+except ImportError:
+    from SocketServer import StreamRequestHandler, ThreadingUnixStreamServer
+
+# upper bounds of latency histogram buckets in seconds
+LATENCY_BUCKETS = (.0001, .0005, .001, .005, .01, .05, .1, .5, 1, 5)
+
+
+class CountingCursorWrapper(CursorWrapper):
+    ''' counts executed queries without keeping their SQL (unlike debug cursor) '''
+
+    def __init__(self, cursor, db, counter):
+        super(CountingCursorWrapper, self).__init__(cursor, db)
+        self.counter = counter
+
+    def callproc(self, procname, params=None):
+        self.counter[0] += 1
+        return super(CountingCursorWrapper, self).callproc(procname, params)
+
+    def execute(self, sql, params=None):
+        self.counter[0] += 1
+        return super(CountingCursorWrapper, self).execute(sql, params)
+
+    def executemany(self, sql, param_list):
+        self.counter[0] += 1
+        return super(CountingCursorWrapper, self).executemany(sql, param_list)
+
+
+@contextmanager
+def count_queries(using=DEFAULT_DB_ALIAS):
+    ''' counts queries executed on this thread's connection, yields one-item list with the count '''
+    db = connections[using]
+    counter = [0]
+    # make_cursor and make_debug_cursor wrap every cursor the connection returns
+    saved = dict((name, db.__dict__.get(name)) for name in ('make_cursor', 'make_debug_cursor'))
+    make_cursor, make_debug_cursor = db.make_cursor, db.make_debug_cursor
+    db.make_cursor = lambda cursor: CountingCursorWrapper(make_cursor(cursor), db, counter)
+    db.make_debug_cursor = lambda cursor: CountingCursorWrapper(make_debug_cursor(cursor), db, counter)
+    try:
+        yield counter
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                delattr(db, name)
+            else:
+                setattr(db, name, value)
+
+
+class OperationMetrics(object):
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.queries = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+
+
+class Metrics(object):
+    ''' collects per-operation metrics and renders them in Prometheus text format '''
+
+    def __init__(self, volume):
+        self.volume = volume
+        self._lock = Lock()
+        self._operations = defaultdict(OperationMetrics)
+        self._hits = defaultdict(int)
+        self._misses = defaultdict(int)
+        self._gauges = {}
+
+    def measure(self, op, func, *args):
+        start = time()
+        result = error = None
+        with count_queries() as counter:
+            try:
+                result = func(*args)
+                return result
+            except Exception:
+                error = True
+                raise
+            finally:
+                seconds = time() - start
+                self._record(op, result, error, seconds, counter[0])
+
+    def _record(self, op, result, error, seconds, queries):
+        if isinstance(result, bytes):
+            size = len(result)
+        elif op == 'write' and result:
+            size = result
+        else:
+            size = 0
+        with self._lock:
+            m = self._operations[op]
+            m.count += 1
+            m.errors += bool(error)
+            m.queries += queries
+            m.bytes += size
+            m.seconds += seconds
+            m.buckets[bisect_left(LATENCY_BUCKETS, seconds)] += 1
+
+    def hit(self, cache):
+        self._hits[cache] += 1
+
+    def miss(self, cache):
+        self._misses[cache] += 1
+
+    def gauge(self, name, description, func):
+        ''' register function returning current value of the gauge '''
+        self._gauges[name] = (description, func)
+
+    def render(self):
+        lines = []
+
+        def header(name, metric_type, description):
+            lines.append('# HELP dbfs_{} {}'.format(name, description))
+            lines.append('# TYPE dbfs_{} {}'.format(name, metric_type))
+
+        def sample(name, labels, value):
+            labels = ','.join('{}="{}"'.format(k, v) for k, v in (('volume', self.volume),) + labels)
+            lines.append('dbfs_{}{{{}}} {}'.format(name, labels, value))
+
+        with self._lock:
+            operations = sorted(self._operations.items())
+            for name, attr, description in (
+                ('operations_total', 'count', 'Number of filesystem operations.'),
+                ('operation_errors_total', 'errors', 'Number of failed filesystem operations.'),
+                ('operation_queries_total', 'queries', 'Number of database queries.'),
+                ('operation_bytes_total', 'bytes', 'Number of bytes read or written.'),
+            ):
+                header(name, 'counter', description)
+                for op, m in operations:
+                    sample(name, (('op', op),), getattr(m, attr))
+            header('operation_seconds', 'histogram', 'Latency of filesystem operations.')
+            for op, m in operations:
+                cumulative = 0
+                for le, count in zip(LATENCY_BUCKETS + ('+Inf',), m.buckets):
+                    cumulative += count
+                    sample('operation_seconds_bucket', (('op', op), ('le', le)), cumulative)
+                sample('operation_seconds_sum', (('op', op),), m.seconds)
+                sample('operation_seconds_count', (('op', op),), m.count)
+
+        caches = sorted(set(self._hits) | set(self._misses))
+        header('cache_hits_total', 'counter', 'Number of cache hits.')
+        for cache in caches:
+            sample('cache_hits_total', (('cache', cache),), self._hits[cache])
+        header('cache_misses_total', 'counter', 'Number of cache misses.')
+        for cache in caches:
+            sample('cache_misses_total', (('cache', cache),), self._misses[cache])
+
+        for name, (description, func) in sorted(self._gauges.items()):
+            header(name, 'gauge', description)
+            sample(name, (), func())
+        return '\n'.join(lines) + '\n'
+
+
+class MetricsRequestHandler(StreamRequestHandler):
+
+    def handle(self):
+        self.wfile.write(self.server.metrics.render().encode('utf-8'))
+
+
+class MetricsServer(ThreadingUnixStreamServer):
+    ''' serves metrics in Prometheus text format on unix socket '''
+
+    daemon_threads = True
+
+    def __init__(self, path, metrics):
+        self.metrics = metrics
+        # remove socket left by previous run, but never anything else
+        if os.path.lexists(path):
+            if not stat.S_ISSOCK(os.lstat(path).st_mode):
+                raise OSError(errno.EEXIST, 'File exists and is not a socket', path)
+            os.unlink(path)
+        ThreadingUnixStreamServer.__init__(self, path, MetricsRequestHandler)
+
+    def start(self):
+        thread = Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        os.unlink(self.server_address)
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11 on 2026-10-19 11:00
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def assign_volumes(apps, schema_editor):
+    ''' assign inodes to volumes by walking the trees and compute usage counters '''
+    Block = apps.get_model('django_dbfs', 'Block')
+    Inode = apps.get_model('django_dbfs', 'Inode')
+    TreeNode = apps.get_model('django_dbfs', 'TreeNode')
+    Volume = apps.get_model('django_dbfs', 'Volume')
+    for root in TreeNode.objects.filter(parent=None):
+        volume = Volume.objects.get_or_create(name=root.name)[0]
+        Inode.objects.filter(pk=root.inode_id).update(volume=volume)
+        parents = [root.pk]
+        while parents:
+            nodes = TreeNode.objects.filter(parent__in=parents).exclude(name__in=('.', '..'))
+            Inode.objects.filter(pk__in=list(nodes.values_list('inode_id', flat=True))).update(volume=volume)
+            parents = list(nodes.values_list('pk', flat=True))
+        usage = Inode.objects.filter(volume=volume).aggregate(size=models.Sum('size'), inodes=models.Count('pk'))
+        Volume.objects.filter(pk=volume.pk).update(
+            used_size=usage['size'] or 0,
+            used_blocks=Block.objects.filter(inode__volume=volume).count(),
+            used_inodes=usage['inodes'],
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_dbfs', '0002_volume'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='volume',
+            name='used_blocks',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='volume',
+            name='used_inodes',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='volume',
+            name='used_size',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='inode',
+            name='volume',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='inodes', to='django_dbfs.Volume'),
+        ),
+        migrations.RunPython(assign_volumes, migrations.RunPython.noop),
+    ]
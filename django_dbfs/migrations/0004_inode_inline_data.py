@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11 on 2026-10-19 12:00
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_dbfs', '0003_volume_usage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='inode',
+            name='inline_data',
+            field=models.BinaryField(null=True),
+        ),
+    ]
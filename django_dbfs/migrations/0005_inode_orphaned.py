@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11 on 2026-10-19 13:00
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_dbfs', '0004_inode_inline_data'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='inode',
+            name='orphaned',
+            field=models.BooleanField(db_index=True, default=False),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11 on 2026-10-19 14:00
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def sequence_to_offset(apps, schema_editor):
+    ''' blocks used to have fixed size given by settings.DBFS_BLOCK_BITS '''
+    Block = apps.get_model('django_dbfs', 'Block')
+    block_size = 1 << int(getattr(settings, 'DBFS_BLOCK_BITS', 19))
+    Block.objects.update(offset=models.F('sequence') * block_size)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_dbfs', '0005_inode_orphaned'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='block',
+            name='offset',
+            field=models.BigIntegerField(default=0),
+            preserve_default=False,
+        ),
+        migrations.RunPython(sequence_to_offset, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='block',
+            unique_together=set([('inode', 'offset')]),
+        ),
+        migrations.RemoveField(
+            model_name='block',
+            name='sequence',
+        ),
+    ]
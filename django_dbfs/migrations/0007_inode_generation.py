@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11 on 2026-10-20 09:00
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_dbfs', '0006_block_offset'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='inode',
+            name='generation',
+            field=models.BigIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11 on 2026-10-20 11:00
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def compute_length(apps, schema_editor):
+    ''' length of existing blocks is the length of their data '''
+    Block = apps.get_model('django_dbfs', 'Block')
+    Block.objects.update(length=models.Func(models.F('data'), function='LENGTH'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_dbfs', '0007_inode_generation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='block',
+            name='length',
+            field=models.BigIntegerField(default=0),
+            preserve_default=False,
+        ),
+        migrations.RunPython(compute_length, migrations.RunPython.noop),
+    ]
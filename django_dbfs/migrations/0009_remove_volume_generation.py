@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11 on 2026-10-20 12:00
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_dbfs', '0008_block_length'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='volume',
+            name='generation',
+        ),
+    ]
@@ -2,10 +2,37 @@ from __future__ import unicode_literals
 
 from time import time
 
-from django.db import models
+from django.db import models, transaction
+
+
+class Volume(models.Model):
+    name = models.CharField(max_length=255, unique=True)
+    # usage counters maintained incrementally and reconciled by command dbfs_reconcile
+    used_size = models.BigIntegerField(default=0)
+    used_blocks = models.BigIntegerField(default=0)
+    used_inodes = models.BigIntegerField(default=0)
+
+    def get_usage(self):
+        return Volume.objects.filter(pk=self.pk).values_list('used_size', 'used_blocks', 'used_inodes').get()
+
+    @transaction.atomic
+    def reconcile(self):
+        ''' recompute usage counters from inodes and blocks of the volume '''
+        # lock the volume, so that the counters are not changed meanwhile
+        Volume.objects.select_for_update().filter(pk=self.pk).values_list('pk').get()
+        usage = Inode.objects.filter(volume=self).aggregate(size=models.Sum('size'), inodes=models.Count('pk'))
+        self.used_size = usage['size'] or 0
+        self.used_inodes = usage['inodes']
+        self.used_blocks = Block.objects.filter(inode__volume=self).count()
+        Volume.objects.filter(pk=self.pk).update(
+            used_size=self.used_size,
+            used_blocks=self.used_blocks,
+            used_inodes=self.used_inodes,
+        )
 
 
 class Inode(models.Model):
+    volume = models.ForeignKey(Volume, null=True, on_delete=models.CASCADE, related_name='inodes')
     inuse = models.IntegerField(default=0)
     mode = models.IntegerField(default=0)
     uid = models.IntegerField(default=0)
@@ -14,6 +41,27 @@ class Inode(models.Model):
     mtime = models.IntegerField(default=0)
     ctime = models.IntegerField(default=0)
     size = models.BigIntegerField(default=0)
+    # content of small files and symlinks, None if stored in blocks
+    inline_data = models.BinaryField(null=True)
+    # neither linked nor open, waiting for the reaper
+    orphaned = models.BooleanField(default=False, db_index=True)
+    # incremented on every change of attributes or data (or entries of the directory)
+    generation = models.BigIntegerField(default=0)
+
+    # size accounted in usage of the volume, shared by all handles of the inode (not saved)
+    flushed_size = 0
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        inode = super(Inode, cls).from_db(db, field_names, values)
+        if 'size' in field_names:
+            inode.flushed_size = inode.size
+        return inode
+
+    def refresh_from_db(self, using=None, fields=None, **kwargs):
+        super(Inode, self).refresh_from_db(using, fields, **kwargs)
+        if fields is None or 'size' in fields:
+            self.flushed_size = self.size
 
     def stat(self):
         return {
@@ -34,37 +82,106 @@ class Inode(models.Model):
         Inode.objects.filter(pk=self.pk).update(inuse=models.F('inuse') - 1)
         self.try_delete()
 
+    def _update(self, conditions=None, **fields):
+        ''' save given fields and increment generation, so that other mounts notice the change
+
+            Returns False, if the stored inode does not match given conditions (and nothing is saved).
+        '''
+        if not Inode.objects.filter(pk=self.pk, **(conditions or {})).update(
+            generation=models.F('generation') + 1, **fields
+        ):
+            return False
+        self.generation += 1
+        return True
+
     def save_mode(self):
         self.ctime = time()
-        Inode.objects.filter(pk=self.pk).update(mode=self.mode, ctime=self.ctime)
+        self._update(mode=self.mode, ctime=self.ctime)
 
     def save_uid_gid(self):
         self.ctime = time()
-        Inode.objects.filter(pk=self.pk).update(uid=self.uid, gid=self.gid, ctime=self.ctime)
+        self._update(uid=self.uid, gid=self.gid, ctime=self.ctime)
 
     def save_times(self):
-        Inode.objects.filter(pk=self.pk).update(atime=self.atime, ctime=self.ctime, mtime=self.mtime)
+        self._update(atime=self.atime, ctime=self.ctime, mtime=self.mtime)
 
-    def save_size(self):
+    def save_size(self, blocks=0, inline=False):
+        ''' save size (and inline data, if inline is True) and update usage of the volume
+            by the difference and given number of new blocks
+
+            Data moved to blocks are never stored inline again. Returns False without saving anything,
+            if inline data should be saved, but another handle has moved the data to blocks meanwhile.
+        '''
         self.ctime = time()
         self.mtime = time()
-        Inode.objects.filter(pk=self.pk).update(size=self.size, ctime=self.ctime, mtime=self.mtime)
+        fields = {'size': self.size, 'ctime': self.ctime, 'mtime': self.mtime}
+        conditions = {}
+        if inline:
+            fields['inline_data'] = self.inline_data
+            if self.inline_data is not None:
+                conditions['inline_data__isnull'] = False
+        # usually nobody else has changed the size since it has been loaded or saved by this mount,
+        # then the conditional update is enough to know the difference without locking the inode
+        if self._update(dict(conditions, size=self.flushed_size), **fields):
+            stored_size = self.flushed_size
+        else:
+            stored_size = Inode.objects.select_for_update().filter(pk=self.pk).values_list('size', flat=True).get()
+            if not self._update(conditions, **fields):
+                return False
+        # volume (single row shared by all mounts) is only updated, if the usage has changed
+        self.update_volume_usage(size=self.size - stored_size, blocks=blocks)
+        self.flushed_size = self.size
+        return True
+
+    def update_volume_usage(self, size=0, blocks=0, inodes=0):
+        if self.volume_id and (size or blocks or inodes):
+            Volume.objects.filter(pk=self.volume_id).update(
+                used_size=models.F('used_size') + size,
+                used_blocks=models.F('used_blocks') + blocks,
+                used_inodes=models.F('used_inodes') + inodes,
+            )
 
     def try_delete(self):
+        ''' mark the inode orphaned, if it is neither linked nor open, the reaper deletes it later '''
         if self.nodes.count() == 0:
-            Inode.objects.filter(pk=self.pk, inuse=0).delete()
+            Inode.objects.filter(pk=self.pk, inuse=0).update(orphaned=True)
+
+    def delete_blocks(self, limit):
+        ''' delete at most limit blocks and return their number '''
+        pks = list(self.blocks.values_list('pk', flat=True)[:limit])
+        if not pks:
+            return 0
+        deleted = Block.objects.filter(pk__in=pks).delete()[0]
+        self.update_volume_usage(blocks=-deleted)
+        return deleted
+
+    def delete_orphan(self):
+        ''' delete orphaned inode, its blocks should be already deleted by delete_blocks '''
+        deleted = Inode.objects.filter(pk=self.pk, orphaned=True).delete()[1]
+        if deleted.get(Inode._meta.label):
+            self.update_volume_usage(
+                size=-self.size,
+                blocks=-deleted.get(Block._meta.label, 0),
+                inodes=-1,
+            )
 
 
 class Block(models.Model):
+    ''' extent of file data starting at given offset
+
+        Length of data is stored too, so that extents overlapping given range may be found
+        without any assumption about their maximum size (which may change with settings).
+    '''
     inode = models.ForeignKey(Inode, on_delete=models.CASCADE, related_name='blocks')
-    sequence = models.BigIntegerField()
+    offset = models.BigIntegerField()
+    length = models.BigIntegerField()
     data = models.BinaryField()
 
     class Meta:
-        unique_together = (('inode', 'sequence'),)
+        unique_together = (('inode', 'offset'),)
 
     def __hash__(self):
-        return hash((self.inode, self.sequence))
+        return hash((self.inode, self.offset))
 
 
 class TreeNode(models.Model):
@@ -0,0 +1,76 @@
+from __future__ import unicode_literals
+
+import logging
+from threading import Event, Thread
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from .models import Inode
+
+logger = logging.getLogger(__name__)
+
+# how often (in seconds) to look for orphaned inodes, 0 disables the reaper thread
+REAPER_INTERVAL = float(getattr(settings, 'DBFS_REAPER_INTERVAL', 10))
+
+# number of blocks deleted in one transaction
+REAPER_BATCH_SIZE = int(getattr(settings, 'DBFS_REAPER_BATCH_SIZE', 100))
+
+# pause (in seconds) between two batches
+REAPER_BATCH_DELAY = float(getattr(settings, 'DBFS_REAPER_BATCH_DELAY', 0.1))
+
+
+class Reaper(object):
+    ''' deletes orphaned inodes of the volume with their blocks in small batches
+
+        Unlink only marks the inode orphaned, so that it does not depend on the size of the file.
+    '''
+
+    def __init__(self, volume):
+        self.volume = volume
+        self._stop = Event()
+        self._thread = None
+
+    def reap(self):
+        ''' delete all orphaned inodes and return their number '''
+        reaped = 0
+        while not self._stop.is_set():
+            inodes = list(Inode.objects.filter(volume=self.volume, orphaned=True).only('pk', 'volume', 'size')[:100])
+            if not inodes:
+                break
+            for inode in inodes:
+                if not self.reap_inode(inode):
+                    return reaped
+                reaped += 1
+        return reaped
+
+    def reap_inode(self, inode):
+        ''' delete blocks of the inode and the inode itself, return False if stopped meanwhile '''
+        while True:
+            with transaction.atomic():
+                deleted = inode.delete_blocks(REAPER_BATCH_SIZE)
+            if deleted < REAPER_BATCH_SIZE:
+                break
+            if self._stop.wait(REAPER_BATCH_DELAY):
+                return False
+        with transaction.atomic():
+            inode.delete_orphan()
+        return True
+
+    def run(self):
+        while not self._stop.wait(REAPER_INTERVAL):
+            try:
+                self.reap()
+            except Exception:
+                logger.exception('Failed to reap orphaned inodes of volume %s', self.volume.name)
+        connection.close()
+
+    def start(self):
+        self._thread = Thread(target=self.run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
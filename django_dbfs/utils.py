@@ -4,6 +4,10 @@ import pwd
 
 from threading import Lock
 
+from django.core.management.base import CommandError
+
+from .models import Volume
+
 
 class ThreadSafeCounter(itertools.count):
     def __init__(self):
@@ -25,3 +29,14 @@ def get_groups(uid, gid):
             if g.gr_gid == gid or pwd.getpwuid(uid).pw_name in g.gr_mem
         ]
     return _groups_cache[(uid, gid)]
+
+
+def get_volumes(names):
+    ''' return volumes with given names (all volumes if no names are given) for management commands '''
+    if not names:
+        return Volume.objects.all()
+    volumes = Volume.objects.filter(name__in=names)
+    missing = set(names) - set(volume.name for volume in volumes)
+    if missing:
+        raise CommandError('Volume {} was not found'.format(', '.join(sorted(missing))))
+    return volumes
@@ -0,0 +1,74 @@
+from __future__ import unicode_literals
+
+import os
+
+from django.db import connection
+from django.test import SimpleTestCase, TestCase
+
+from django_dbfs.bench import Benchmark, Result, compare, fuse_context
+
+
+class ResultTestCase(SimpleTestCase):
+
+    def test_as_dict(self):
+        result = Result()
+        result.latencies = [.003, .001, .002, .004]
+        result.queries = 10
+        result.bytes = 4096
+        data = result.as_dict()
+        self.assertEqual(data['ops'], 4)
+        self.assertAlmostEqual(data['seconds'], .01)
+        self.assertAlmostEqual(data['ops_per_second'], 400)
+        self.assertEqual(data['queries_per_op'], 2.5)
+        self.assertEqual(data['bytes_per_op'], 1024)
+        self.assertAlmostEqual(data['latency_mean_us'], 2500)
+        self.assertAlmostEqual(data['latency_p50_us'], 3000)
+        self.assertAlmostEqual(data['latency_p95_us'], 4000)
+
+    def test_as_dict_without_operations(self):
+        data = Result().as_dict()
+        self.assertEqual(data['ops'], 0)
+        self.assertEqual(data['latency_p95_us'], 0)
+
+
+class CompareTestCase(SimpleTestCase):
+
+    baseline = {
+        'read': {'queries_per_op': 1.0, 'latency_mean_us': 100.0},
+        'write': {'queries_per_op': 2.0, 'latency_mean_us': 200.0},
+    }
+
+    def test_within_tolerance(self):
+        results = {
+            'read': {'queries_per_op': 1.0, 'latency_mean_us': 109.0},
+            'write': {'queries_per_op': 1.5, 'latency_mean_us': 150.0},
+        }
+        self.assertEqual(compare(results, self.baseline, .1), [])
+
+    def test_regressions(self):
+        results = {
+            'read': {'queries_per_op': 1.01, 'latency_mean_us': 100.0},
+            'write': {'queries_per_op': 2.0, 'latency_mean_us': 221.0},
+        }
+        self.assertEqual(compare(results, self.baseline, .1), [
+            'read: queries per op 1.00 -> 1.01',
+            'write: mean latency 200us -> 221us',
+        ])
+
+    def test_new_scenario_is_skipped(self):
+        results = {'rename': {'queries_per_op': 100.0, 'latency_mean_us': 1e6}}
+        self.assertEqual(compare(results, self.baseline, .1), [])
+
+
+class BenchmarkTestCase(TestCase):
+
+    def test_run(self):
+        benchmark = Benchmark(file_size=4096, chunk_size=1024, files=3, depth=2)
+        with fuse_context(os.getuid(), os.getgid(), os.getpid()):
+            results = benchmark.run(['sequential_write', 'deep_stat'])
+        self.assertEqual(sorted(results), ['deep_stat', 'sequential_write', 'sequential_write_flush'])
+        self.assertEqual(results['sequential_write']['ops'], 4)
+        self.assertEqual(results['sequential_write']['bytes_per_op'], 1024)
+        self.assertGreater(results['sequential_write_flush']['queries_per_op'], 0)
+        self.assertEqual(results['deep_stat']['ops'], 3)
+        self.assertFalse(connection.queries_log)
@@ -0,0 +1,91 @@
+from __future__ import unicode_literals
+
+import os
+
+from fuse import FuseOSError
+
+from django_dbfs import fs
+from django_dbfs.fs import DbFs
+from django_dbfs.metrics import Metrics
+from django_dbfs.models import Inode
+
+from .utils import DbFsTestCase, patch
+
+
+class InterruptingMetrics(Metrics):
+    ''' commits a tree change by "another thread" on cache miss, i.e. during the lookup '''
+
+    def __init__(self, fs):
+        super(InterruptingMetrics, self).__init__(fs.volume)
+        self.fs = fs
+
+    def miss(self, cache):
+        super(InterruptingMetrics, self).miss(cache)
+        self.fs._committed([])
+
+
+class CoherenceTestCase(DbFsTestCase):
+
+    def test_data_change_by_another_mount(self):
+        self.write_file('/file', b'old')
+        other = DbFs(self.volume)
+        root = self.fs._root_node().inode
+        fh = other.open('/file', os.O_WRONLY)
+        other.write('/file', b'new', 0, fh)
+        other.flush('/file', fh)
+        other.release('/file', fh)
+        # data changes do not touch the generation of the directory
+        self.assertEqual(Inode.objects.get(pk=root.pk).generation, root.generation)
+        with patch(fs, COHERENCE_INTERVAL=0):
+            self.assertEqual(self.read_file('/file'), b'new')
+
+    def test_chmod_by_another_mount(self):
+        self.write_file('/file', b'data')
+        DbFs(self.volume).chmod('/file', 0o100600)
+        with patch(fs, COHERENCE_INTERVAL=0):
+            self.assertEqual(self.fs.getattr('/file')['st_mode'], 0o100600)
+
+    def test_unlink_by_another_mount(self):
+        self.write_file('/file', b'data')
+        DbFs(self.volume).unlink('/file')
+        with patch(fs, COHERENCE_INTERVAL=0):
+            self.assertFalse(self.exists('/file'))
+            with self.assertRaises(FuseOSError):
+                self.fs.getattr('/file')
+
+    def test_rename_by_another_mount(self):
+        self.fs.mkdir('/a', 0o755)
+        self.fs.mkdir('/b', 0o755)
+        self.write_file('/a/file', b'data')
+        self.write_file('/b/other', b'data')
+        DbFs(self.volume).rename('/a/file', '/b/file')
+        with patch(fs, COHERENCE_INTERVAL=0):
+            self.assertFalse(self.exists('/a/file'))
+            self.assertEqual(self.read_file('/b/file'), b'data')
+
+    def test_only_changed_directory_is_dropped(self):
+        self.fs.mkdir('/a', 0o755)
+        self.fs.mkdir('/b', 0o755)
+        self.write_file('/a/file', b'data')
+        self.write_file('/b/file', b'data')
+        a = self.fs._resolve('/a')
+        b = self.fs._resolve('/b')
+        DbFs(self.volume).unlink('/a/file')
+        with patch(fs, COHERENCE_INTERVAL=0):
+            self.fs._check_generation()
+        self.assertNotIn((a.pk, 'file'), self.fs._nodes)
+        self.assertIn((b.pk, 'file'), self.fs._nodes)
+        self.assertIn((self.fs._root_node().pk, 'a'), self.fs._nodes)
+
+    def test_node_looked_up_during_change_is_not_cached(self):
+        self.write_file('/file', b'data')
+        self.fs._clear_cache()
+        root = self.fs._root_node()
+        self.fs.metrics = InterruptingMetrics(self.fs)
+        node = self.fs._resolve_subnode(root, 'file')
+        self.assertEqual(node.name, 'file')
+        self.assertNotIn((root.pk, 'file'), self.fs._nodes)
+        # nothing has changed during the next lookup
+        self.fs.metrics = None
+        self.fs._resolve_subnode(root, 'file')
+        self.assertIn((root.pk, 'file'), self.fs._nodes)
@@ -0,0 +1,207 @@
+from __future__ import unicode_literals
+
+import os
+import random
+
+from django_dbfs import file
+from django_dbfs.file import OpenFile
+from django_dbfs.models import Block, Inode
+
+from .utils import DbFsTestCase, patch
+
+
+class ExtentsTestCase(DbFsTestCase):
+    ''' compares random writes, truncates and reads with reference buffer (with tiny extents) '''
+
+    def setUp(self):
+        super(ExtentsTestCase, self).setUp()
+        self.random = random.Random(0)
+
+    def check(self, iterations):
+        fs = self.fs
+        model = bytearray(self.read_file('/file')) if self.exists('/file') else bytearray()
+        if not self.exists('/file'):
+            fs.release('/file', fs.create('/file', 0o100644))
+        fh = fs.open('/file', os.O_RDWR)
+        for i in range(iterations):
+            op = self.random.random()
+            if op < 0.5:
+                offset = self.random.randint(0, len(model) + 50)
+                data = os.urandom(self.random.randint(1, 200))
+                fs.write('/file', data, offset, fh)
+                model.extend(b'\x00' * (offset - len(model)))
+                model[offset:offset + len(data)] = data
+            elif op < 0.6:
+                length = self.random.randint(0, len(model) + 50)
+                fs.truncate('/file', length, fh)
+                del model[length:]
+                model.extend(b'\x00' * (length - len(model)))
+            elif op < 0.8:
+                fs.flush('/file', fh)
+                fs.release('/file', fh)
+                fh = fs.open('/file', os.O_RDWR)
+            else:
+                offset = self.random.randint(0, len(model) + 10)
+                length = self.random.randint(0, 300)
+                self.assertEqual(fs.read('/file', length, offset, fh), bytes(model[offset:offset + length]))
+            self.assertEqual(fs.getattr('/file')['st_size'], len(model))
+        fs.flush('/file', fh)
+        fs.release('/file', fh)
+        self.assertEqual(self.read_file('/file'), bytes(model))
+        self.check_blocks()
+
+    def check_blocks(self):
+        ''' stored extents have correct length and they do not overlap '''
+        blocks = list(Block.objects.order_by('offset'))
+        for block in blocks:
+            self.assertEqual(block.length, len(block.data))
+        for block, next_block in zip(blocks, blocks[1:]):
+            self.assertLessEqual(block.offset + block.length, next_block.offset)
+        usage = self.fs._volume.get_usage()
+        self.fs._volume.reconcile()
+        self.assertEqual(self.fs._volume.get_usage(), usage)
+
+    def test_random_operations(self):
+        with patch(file, EXTENT_SIZE=64, READ_AHEAD=32, INLINE_SIZE=16):
+            self.check(500)
+        self.assertTrue(all(block.length <= 64 for block in Block.objects.all()))
+
+    def test_changed_extent_size(self):
+        ''' extents stored with larger EXTENT_SIZE are found and overwritten '''
+        with patch(file, EXTENT_SIZE=256, READ_AHEAD=0, INLINE_SIZE=0):
+            self.write_file('/file', os.urandom(1000))
+        with patch(file, EXTENT_SIZE=16, READ_AHEAD=8, INLINE_SIZE=0):
+            self.check(300)
+
+    def test_appends_grow_the_last_extent(self):
+        with patch(file, EXTENT_SIZE=64, READ_AHEAD=0, INLINE_SIZE=0):
+            data = b''
+            for i in range(5):
+                chunk = os.urandom(10)
+                fh = self.fs.open('/file', os.O_WRONLY | os.O_APPEND) if data else self.fs.create('/file', 0o100644)
+                self.fs.write('/file', chunk, len(data), fh)
+                self.fs.flush('/file', fh)
+                self.fs.release('/file', fh)
+                data += chunk
+        self.assertEqual(list(Block.objects.values_list('offset', 'length')), [(0, 50)])
+        self.assertEqual(self.read_file('/file'), data)
+
+    def write_by_two_handles(self, flush_order):
+        ''' handles write overlapping ranges, each of them to another extent '''
+        with patch(file, EXTENT_SIZE=64, READ_AHEAD=0, INLINE_SIZE=0):
+            self.write_file('/file', b'a' * 10)
+            fh = {name: self.fs.open('/file', os.O_WRONLY) for name in 'AB'}
+            self.fs.write('/file', b'B' * 10, 50, fh['B'])
+            self.fs.write('/file', b'A' * 90, 10, fh['A'])
+            for name in flush_order:
+                self.fs.flush('/file', fh[name])
+            for name in flush_order:
+                self.fs.release('/file', fh[name])
+            self.check_blocks()
+            return self.read_file('/file')
+
+    def test_new_extent_overlapped_by_another_handle(self):
+        self.assertEqual(self.write_by_two_handles('BA'), b'a' * 10 + b'A' * 90)
+
+    def test_grown_extent_overlapped_by_another_handle(self):
+        self.assertEqual(self.write_by_two_handles('AB'), b'a' * 10 + b'A' * 40 + b'B' * 10 + b'A' * 40)
+
+    def test_merged_extent_written_again(self):
+        self.write_by_two_handles('BA')
+        with patch(file, EXTENT_SIZE=64, READ_AHEAD=0, INLINE_SIZE=0):
+            fh_1 = self.fs.open('/file', os.O_WRONLY)
+            fh_2 = self.fs.open('/file', os.O_WRONLY)
+            self.fs.write('/file', b'C' * 10, 120, fh_2)
+            self.fs.write('/file', b'D' * 30, 100, fh_1)
+            self.fs.flush('/file', fh_1)
+            self.fs.flush('/file', fh_2)
+            # the extent written by the first handle has been replaced by the second one,
+            # it is merged again (data of the whole extent written last win)
+            self.fs.write('/file', b'E', 125, fh_1)
+            self.fs.flush('/file', fh_1)
+            for fh in (fh_1, fh_2):
+                self.fs.release('/file', fh)
+            self.check_blocks()
+        self.assertEqual(self.read_file('/file')[100:], b'D' * 25 + b'E' + b'D' * 2 + b'C' * 2)
+
+    def test_loaded_ranges_are_merged(self):
+        with patch(file, EXTENT_SIZE=64, READ_AHEAD=0, INLINE_SIZE=0):
+            self.write_file('/file', os.urandom(1000))
+            f = OpenFile(self.fs._resolve('/file').inode, os.O_RDONLY)
+            for offset in (500, 100, 300, 200, 0, 400):
+                f.seek(offset)
+                f.read(100)
+            self.assertEqual(f._loaded, [(0, 600)])
+            f.close()
+
+
+class InlineTestCase(DbFsTestCase):
+
+    def read_inode(self, pk):
+        ''' read the file through new handle, bypassing inodes cached by self.fs '''
+        f = OpenFile(Inode.objects.get(pk=pk), os.O_RDONLY)
+        try:
+            return f.read(f.inode.size)
+        finally:
+            f.close()
+
+    def test_small_file_is_inline(self):
+        self.write_file('/file', b'hello')
+        inode = Inode.objects.get(inline_data__isnull=False)
+        self.assertEqual(bytes(inode.inline_data), b'hello')
+        self.assertFalse(inode.blocks.exists())
+        self.assertEqual(self.read_file('/file'), b'hello')
+
+    def test_promotion(self):
+        self.write_file('/file', b'hello')
+        data = os.urandom(file.INLINE_SIZE)
+        self.write_file('/file', data, 3)
+        inode = Inode.objects.get(blocks__isnull=False)
+        self.assertIsNone(inode.inline_data)
+        self.assertEqual(inode.blocks.count(), 1)
+        self.assertEqual(self.read_file('/file'), b'hel' + data)
+        self.assertEqual(self.fs._volume.get_usage(), (3 + len(data), 1, 2))
+
+    def test_promotion_by_another_handle(self):
+        ''' handle with stale inline data must not store them inline again '''
+        self.write_file('/file', b'abc')
+        pk = self.fs._resolve('/file').inode.pk
+        f1 = OpenFile(Inode.objects.get(pk=pk), os.O_RDWR)
+        f2 = OpenFile(Inode.objects.get(pk=pk), os.O_RDWR)
+        data = b'x' * (file.INLINE_SIZE + 1)
+        f1.write(data)
+        f1.flush()
+        f2.seek(1)
+        f2.write(b'b')
+        f2.flush()
+        f1.close()
+        f2.close()
+
+        inode = Inode.objects.get(pk=pk)
+        self.assertIsNone(inode.inline_data)
+        self.assertEqual(inode.blocks.count(), 1)
+        self.assertEqual(self.read_inode(pk), b'xb' + data[2:])
+        usage = self.fs._volume.get_usage()
+        self.fs._volume.reconcile()
+        self.assertEqual(self.fs._volume.get_usage(), usage)
+
+    def test_truncate_after_promotion_by_another_handle(self):
+        self.write_file('/file', b'abc')
+        pk = self.fs._resolve('/file').inode.pk
+        f1 = OpenFile(Inode.objects.get(pk=pk), os.O_RDWR)
+        f2 = OpenFile(Inode.objects.get(pk=pk), os.O_RDWR)
+        f1.write(b'y' * (file.INLINE_SIZE + 1))
+        f1.flush()
+        f2.truncate(2)
+        f1.close()
+        f2.close()
+
+        inode = Inode.objects.get(pk=pk)
+        self.assertIsNone(inode.inline_data)
+        self.assertEqual(inode.size, 2)
+        self.assertEqual(self.read_inode(pk), b'yy')
+
+    def test_symlink(self):
+        self.fs.symlink('/link', '/some/where')
+        self.assertEqual(self.fs.readlink('/link'), b'/some/where')
+        self.assertFalse(Block.objects.exists())
@@ -0,0 +1,73 @@
+from __future__ import unicode_literals
+
+import os
+import shutil
+from tempfile import mkdtemp
+
+from django.db import connection
+from django.test import TestCase
+
+from django_dbfs.metrics import Metrics, MetricsServer, count_queries
+from django_dbfs.models import Volume
+
+from .utils import DbFsTestCase
+
+
+class MetricsTestCase(DbFsTestCase):
+
+    def setUp(self):
+        super(MetricsTestCase, self).setUp()
+        self.fs.metrics = Metrics(self.volume)
+
+    def test_queries_are_counted(self):
+        fh = self.fs('create', '/file', 0o100644)
+        self.fs('write', '/file', b'x' * 10000, 0, fh)
+        self.fs('release', '/file', fh)
+        operations = self.fs.metrics._operations
+        self.assertEqual(operations['create'].count, 1)
+        self.assertGreater(operations['create'].queries, 0)
+        self.assertEqual(operations['write'].bytes, 10000)
+        # SQL of queries (with written data) is not kept
+        self.assertFalse(connection.queries_log)
+
+    def test_errors_are_counted(self):
+        with self.assertRaises(Exception):
+            self.fs('getattr', '/missing')
+        self.assertEqual(self.fs.metrics._operations['getattr'].errors, 1)
+
+    def test_render(self):
+        self.fs('getattr', '/')
+        text = self.fs.metrics.render()
+        self.assertIn('dbfs_operations_total{volume="TEST",op="getattr"} 1\n', text)
+        self.assertIn('# TYPE dbfs_operation_seconds histogram\n', text)
+        self.assertIn('dbfs_operation_seconds_count{volume="TEST",op="getattr"} 1\n', text)
+
+    def test_nested_counting(self):
+        with count_queries() as outer:
+            with count_queries() as inner:
+                Volume.objects.count()
+            Volume.objects.count()
+        self.assertEqual((outer[0], inner[0]), (2, 1))
+        self.assertNotIn('make_cursor', connection.__dict__)
+
+
+class MetricsServerTestCase(TestCase):
+
+    def setUp(self):
+        self.path = os.path.join(mkdtemp(), 'stats')
+        self.addCleanup(shutil.rmtree, os.path.dirname(self.path))
+
+    def test_stale_socket_is_replaced(self):
+        MetricsServer(self.path, Metrics('TEST')).server_close()
+        server = MetricsServer(self.path, Metrics('TEST'))
+        server.start()
+        server.stop()
+        self.assertFalse(os.path.lexists(self.path))
+
+    def test_other_file_is_kept(self):
+        with open(self.path, 'w') as f:
+            f.write('data')
+        with self.assertRaises(OSError):
+            MetricsServer(self.path, Metrics('TEST'))
+        with open(self.path) as f:
+            self.assertEqual(f.read(), 'data')
@@ -0,0 +1,103 @@
+from __future__ import unicode_literals
+
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TransactionTestCase, override_settings
+
+
+class MigrationTestCase(TransactionTestCase):
+    ''' migrates to migrate_from, lets prepare data and then migrates to migrate_to '''
+
+    migrate_from = None
+    migrate_to = None
+
+    def migrate(self, name):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate([('django_dbfs', name)])
+        return executor.loader.project_state([('django_dbfs', name)]).apps
+
+    def setUp(self):
+        self.addCleanup(self.migrate_to_latest)
+        self.apps = self.migrate(self.migrate_from)
+
+    def migrate_to_latest(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def create_inode(self, **kwargs):
+        Inode = self.apps.get_model('django_dbfs', 'Inode')
+        fields = dict(mode=0o100644, uid=0, gid=0, atime=0, mtime=0, ctime=0)
+        fields.update(kwargs)
+        return Inode.objects.create(**fields)
+
+
+class VolumeUsageTestCase(MigrationTestCase):
+
+    migrate_from = '0002_volume'
+    migrate_to = '0003_volume_usage'
+
+    def create_tree(self, name, depth, block_size):
+        ''' create volume with a chain of depth directories, each of them containing one file '''
+        Block = self.apps.get_model('django_dbfs', 'Block')
+        TreeNode = self.apps.get_model('django_dbfs', 'TreeNode')
+        root = TreeNode.objects.create(parent=None, name=name, inode=self.create_inode(mode=0o40755, size=0))
+        TreeNode.objects.create(parent=root, name='.', inode=root.inode)
+        TreeNode.objects.create(parent=root, name='..', inode=root.inode)
+        parent = root
+        for i in range(depth):
+            node = TreeNode.objects.create(parent=parent, name='dir', inode=self.create_inode(mode=0o40755, size=0))
+            TreeNode.objects.create(parent=node, name='.', inode=node.inode)
+            TreeNode.objects.create(parent=node, name='..', inode=parent.inode)
+            inode = self.create_inode(size=block_size)
+            TreeNode.objects.create(parent=node, name='file', inode=inode)
+            Block.objects.create(inode=inode, sequence=0, data=b'x' * block_size)
+            parent = node
+
+    def test_assign_volumes(self):
+        self.create_tree('A', 3, 10)
+        self.create_tree('B', 5, 100)
+
+        apps = self.migrate(self.migrate_to)
+        Inode = apps.get_model('django_dbfs', 'Inode')
+        Volume = apps.get_model('django_dbfs', 'Volume')
+        self.assertFalse(Inode.objects.filter(volume=None).exists())
+        self.assertEqual(
+            sorted(Volume.objects.values_list('name', 'used_size', 'used_blocks', 'used_inodes')),
+            [('A', 30, 3, 7), ('B', 500, 5, 11)],
+        )
+        for volume in Volume.objects.all():
+            self.assertEqual(Inode.objects.filter(volume=volume).count(), volume.used_inodes)
+
+
+class BlockOffsetTestCase(MigrationTestCase):
+
+    migrate_from = '0005_inode_orphaned'
+    migrate_to = '0006_block_offset'
+
+    @override_settings(DBFS_BLOCK_BITS=10)
+    def test_sequence_to_offset(self):
+        Block = self.apps.get_model('django_dbfs', 'Block')
+        inode = self.create_inode(size=2100)
+        for sequence, data in ((0, b'a' * 1024), (2, b'b' * 52)):
+            Block.objects.create(inode=inode, sequence=sequence, data=data)
+
+        apps = self.migrate(self.migrate_to)
+        Block = apps.get_model('django_dbfs', 'Block')
+        self.assertEqual(list(Block.objects.order_by('offset').values_list('offset', flat=True)), [0, 2048])
+
+
+class BlockLengthTestCase(MigrationTestCase):
+
+    migrate_from = '0007_inode_generation'
+    migrate_to = '0008_block_length'
+
+    def test_length_of_data(self):
+        Block = self.apps.get_model('django_dbfs', 'Block')
+        inode = self.create_inode(size=8194)
+        Block.objects.create(inode=inode, offset=0, data=b'\x00\xff' * 3000)
+        Block.objects.create(inode=inode, offset=8192, data=b'ab')
+
+        apps = self.migrate(self.migrate_to)
+        Block = apps.get_model('django_dbfs', 'Block')
+        self.assertEqual(list(Block.objects.order_by('offset').values_list('offset', 'length')), [(0, 6000), (8192, 2)])
@@ -0,0 +1,78 @@
+from __future__ import unicode_literals
+
+import os
+
+from django.core.management import CommandError, call_command
+from django.utils.six import StringIO
+
+from django_dbfs import fs, reaper
+from django_dbfs.fs import DbFs
+from django_dbfs.models import Block, Inode
+from django_dbfs.reaper import Reaper
+
+from .utils import DbFsTestCase, patch
+
+
+class ReaperTestCase(DbFsTestCase):
+
+    def test_unlink_orphans_inode(self):
+        self.write_file('/file', os.urandom(10000))
+        self.fs.unlink('/file')
+        inode = Inode.objects.get(orphaned=True)
+        self.assertEqual(inode.blocks.count(), 1)
+
+    def test_open_file_is_not_orphaned(self):
+        self.write_file('/file', os.urandom(1000))
+        fh = self.fs.open('/file', os.O_RDONLY)
+        self.fs.unlink('/file')
+        self.assertFalse(Inode.objects.filter(orphaned=True).exists())
+        self.fs.release('/file', fh)
+        self.assertTrue(Inode.objects.filter(orphaned=True).exists())
+
+    def test_reap_in_batches(self):
+        inode = Inode.objects.create(
+            volume=self.fs._volume, mode=0o100644, uid=0, gid=0, atime=0, mtime=0, ctime=0, size=7,
+        )
+        for offset in range(7):
+            Block.objects.create(inode=inode, offset=offset, length=1, data=b'x')
+        inode.update_volume_usage(size=7, blocks=7, inodes=1)
+        usage = self.fs._volume.get_usage()
+        Inode.objects.filter(pk=inode.pk).update(orphaned=True)
+
+        deleted = []
+        delete_blocks = Inode.delete_blocks
+
+        def logged_delete_blocks(inode, limit):
+            deleted.append(delete_blocks(inode, limit))
+            return deleted[-1]
+
+        with patch(reaper, REAPER_BATCH_SIZE=3, REAPER_BATCH_DELAY=0), patch(
+            Inode, delete_blocks=logged_delete_blocks,
+        ):
+            self.assertEqual(Reaper(self.fs._volume).reap(), 1)
+        self.assertEqual(deleted, [3, 3, 1])
+        self.assertFalse(Inode.objects.filter(pk=inode.pk).exists())
+        self.assertFalse(Block.objects.exists())
+        self.assertEqual(self.fs._volume.get_usage(), (usage[0] - 7, usage[1] - 7, usage[2] - 1))
+
+    def test_reap_unlinked_file(self):
+        self.write_file('/file', os.urandom(10000))
+        self.fs.unlink('/file')
+        self.assertEqual(Reaper(self.fs._volume).reap(), 1)
+        self.assertEqual(self.fs._volume.get_usage(), (0, 0, 1))
+
+    def test_no_thread_without_threads(self):
+        with patch(fs, REAPER_INTERVAL=10):
+            dbfs = DbFs(self.volume, nothreads=True)
+            dbfs.init('/')
+            self.assertIsNone(dbfs._reaper._thread)
+            dbfs.destroy('/')
+
+    def test_command(self):
+        self.write_file('/file', b'data')
+        self.fs.unlink('/file')
+        out = StringIO()
+        call_command('dbfs_reap', self.volume, stdout=out)
+        self.assertEqual(out.getvalue(), 'TEST: 1 inodes deleted\n')
+        with self.assertRaisesMessage(CommandError, 'Volume MISSING, OTHER was not found'):
+            call_command('dbfs_reap', self.volume, 'OTHER', 'MISSING')
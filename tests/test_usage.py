@@ -0,0 +1,124 @@
+from __future__ import unicode_literals
+
+import errno
+import os
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from fuse import FuseOSError
+
+from django_dbfs.fs import FRAGMENT_SIZE
+from django_dbfs.models import Inode, Volume
+
+from .utils import DbFsTestCase
+
+
+class UsageTestCase(DbFsTestCase):
+
+    def test_counters(self):
+        self.fs.mkdir('/dir', 0o755)
+        self.write_file('/dir/small', b'x' * 10)
+        self.write_file('/dir/large', os.urandom(100000))
+        usage = self.fs._volume.get_usage()
+        self.assertEqual(usage, (100010, 1, 4))
+        self.fs._volume.reconcile()
+        self.assertEqual(self.fs._volume.get_usage(), usage)
+
+    def test_overwrite_does_not_update_volume(self):
+        self.write_file('/file', os.urandom(10000))
+        fh = self.fs.open('/file', os.O_WRONLY)
+        self.fs.write('/file', os.urandom(100), 0, fh)
+        with CaptureQueriesContext(connection) as queries:
+            self.fs.flush('/file', fh)
+        self.fs.release('/file', fh)
+        sql = ' '.join(query['sql'] for query in queries.captured_queries)
+        connection.queries_log.clear()
+        self.assertNotIn(Volume._meta.db_table, sql)
+        self.assertEqual(self.fs._volume.get_usage()[0], 10000)
+
+    def test_size_changed_by_another_mount(self):
+        self.write_file('/file', b'x' * 10)
+        pk = self.fs._resolve('/file').inode.pk
+        inode_1 = Inode.objects.get(pk=pk)
+        inode_2 = Inode.objects.get(pk=pk)
+        inode_2.size = 1000
+        inode_2.save_size()
+        # inode_1 does not know about the change, the difference is computed from the stored size
+        inode_1.size = 500
+        inode_1.save_size()
+        self.assertEqual(inode_1.flushed_size, 500)
+        usage = self.fs._volume.get_usage()
+        self.assertEqual(usage[0], 500)
+        self.fs._volume.reconcile()
+        self.assertEqual(self.fs._volume.get_usage(), usage)
+
+    def test_statfs(self):
+        self.write_file('/file', os.urandom(10000))
+        st = self.fs.statfs('/')
+        self.assertEqual(st['f_frsize'], FRAGMENT_SIZE)
+        self.assertEqual(st['f_blocks'] - st['f_bfree'], 3)
+        self.assertEqual(st['f_files'] - st['f_ffree'], 2)
+
+    def test_statfs_with_quota(self):
+        self.fs.quota = 100 * FRAGMENT_SIZE
+        self.write_file('/file', os.urandom(10 * FRAGMENT_SIZE))
+        st = self.fs.statfs('/')
+        self.assertEqual(st['f_blocks'], 100)
+        self.assertEqual(st['f_bfree'], 90)
+        self.assertEqual(st['f_bavail'], 90)
+
+
+class QuotaTestCase(DbFsTestCase):
+
+    def setUp(self):
+        super(QuotaTestCase, self).setUp()
+        self.fs.quota = 100000
+
+    def assertQuotaExceeded(self, path, data, offset, fh):
+        with self.assertRaises(FuseOSError) as cm:
+            self.fs.write(path, data, offset, fh)
+        self.assertEqual(cm.exception.errno, errno.EDQUOT)
+
+    def test_quota(self):
+        self.write_file('/a', b'x' * 60000)
+        fh = self.fs.create('/b', 0o100644)
+        self.assertQuotaExceeded('/b', b'x' * 50000, 0, fh)
+        # overwrite does not need any space
+        self.write_file('/a', b'y' * 60000)
+        self.fs.release('/b', fh)
+
+    def test_unflushed_files(self):
+        ''' unflushed growth of all open files is counted '''
+        fh_a = self.fs.create('/a', 0o100644)
+        fh_b = self.fs.create('/b', 0o100644)
+        self.fs.write('/a', b'x' * 100000, 0, fh_a)
+        self.assertQuotaExceeded('/b', b'x' * 100000, 0, fh_b)
+        self.fs.truncate('/a', 50000, fh_a)
+        self.fs.write('/b', b'x' * 50000, 0, fh_b)
+        for path, fh in (('/a', fh_a), ('/b', fh_b)):
+            self.fs.flush(path, fh)
+            self.fs.release(path, fh)
+        self.assertEqual(self.fs._volume.get_usage()[0], 100000)
+
+    def test_file_open_twice(self):
+        fh_1 = self.fs.create('/a', 0o100644)
+        fh_2 = self.fs.open('/a', os.O_WRONLY)
+        self.fs.write('/a', b'x' * 60000, 0, fh_1)
+        # both handles share the inode, the growth is only counted once
+        self.fs.write('/a', b'x' * 30000, 60000, fh_2)
+        for fh in (fh_1, fh_2):
+            self.fs.flush('/a', fh)
+            self.fs.release('/a', fh)
+        self.assertEqual(self.fs._volume.get_usage()[0], 90000)
+
+    def test_file_opened_again_before_flush(self):
+        fh_1 = self.fs.create('/a', 0o100644)
+        self.fs.write('/a', b'x' * 90000, 0, fh_1)
+        # new handle must not take the unflushed size of the shared inode for the accounted one
+        fh_2 = self.fs.open('/a', os.O_RDONLY)
+        fh_3 = self.fs.create('/c', 0o100644)
+        self.assertQuotaExceeded('/c', b'x' * 90000, 0, fh_3)
+        for path, fh in (('/a', fh_1), ('/a', fh_2), ('/c', fh_3)):
+            self.fs.flush(path, fh)
+            self.fs.release(path, fh)
+        self.assertEqual(self.fs._volume.get_usage()[0], 90000)
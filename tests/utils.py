@@ -0,0 +1,50 @@
+from __future__ import unicode_literals
+
+import os
+from contextlib import contextmanager
+
+from django.test import TestCase
+
+from django_dbfs.bench import fuse_context
+from django_dbfs.fs import DbFs
+
+
+@contextmanager
+def patch(obj, **attrs):
+    ''' temporarily replace attributes (e.g. module level settings) of given object '''
+    old = {name: getattr(obj, name) for name in attrs}
+    for name, value in attrs.items():
+        setattr(obj, name, value)
+    try:
+        yield
+    finally:
+        for name, value in old.items():
+            setattr(obj, name, value)
+
+
+class DbFsTestCase(TestCase):
+    ''' provides mounted volume self.fs without kernel, calls are made by the current user '''
+
+    volume = 'TEST'
+
+    def setUp(self):
+        context = fuse_context(os.getuid(), os.getgid(), os.getpid())
+        context.__enter__()
+        self.addCleanup(context.__exit__, None, None, None)
+        self.fs = DbFs(self.volume)
+
+    def write_file(self, path, data, offset=0):
+        fh = self.fs.open(path, os.O_WRONLY) if self.exists(path) else self.fs.create(path, 0o100644)
+        self.fs.write(path, data, offset, fh)
+        self.fs.flush(path, fh)
+        self.fs.release(path, fh)
+
+    def read_file(self, path):
+        fh = self.fs.open(path, os.O_RDONLY)
+        try:
+            return self.fs.read(path, self.fs.getattr(path)['st_size'], 0, fh)
+        finally:
+            self.fs.release(path, fh)
+
+    def exists(self, path):
+        return os.path.basename(path) in self.fs.readdir(os.path.dirname(path), None)